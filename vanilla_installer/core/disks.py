@@ -4,6 +4,8 @@ import subprocess
 
 
 class Diskutils:
+    lvm_pvs = None
+
     @staticmethod
     def pretty_size(size: int) -> str:
         if size > 1024**3:
@@ -33,17 +35,23 @@ class Diskutils:
         return "/dev/" + info["pkname"], str(info["partn"])
 
     @staticmethod
-    def fetch_lvm_pvs() -> list[list[str]]:
-        output_json = subprocess.check_output("sudo pvs --reportformat=json", shell=True).decode(
-            "utf-8"
-        )
-        output_pvs = json.loads(output_json)["report"][0]["pv"]
-        pv_with_vgs = []
-        for pv_output in output_pvs:
-            pv_name = pv_output["pv_name"]
-            vg_name = pv_output["vg_name"] if pv_output["vg_name"] != "" else None
-            pv_with_vgs.append([pv_name, vg_name])
-        return pv_with_vgs
+    def fetch_lvm_pvs(refresh: bool = False) -> list[list[str]]:
+        # pvs forks, rescans LVM metadata and prompts for sudo every time, so
+        # keep one snapshot around and only re-query when the caller knows the
+        # on-disk state may have changed
+        if Diskutils.lvm_pvs is None or refresh:
+            output_json = subprocess.check_output(
+                "sudo pvs --reportformat=json", shell=True
+            ).decode("utf-8")
+            output_pvs = json.loads(output_json)["report"][0]["pv"]
+            pv_with_vgs = []
+            for pv_output in output_pvs:
+                pv_name = pv_output["pv_name"]
+                vg_name = pv_output["vg_name"] if pv_output["vg_name"] != "" else None
+                pv_with_vgs.append([pv_name, vg_name])
+            Diskutils.lvm_pvs = pv_with_vgs
+
+        return Diskutils.lvm_pvs
 
 
 class Disk:
@@ -8,7 +8,7 @@ class Systeminfo:
 
     @staticmethod
     def is_uefi() -> bool:
-        if not Systeminfo.uefi:
+        if Systeminfo.uefi is None:
             proc = subprocess.Popen(["test", "-d", "/sys/firmware/efi"])
             proc.wait()
             Systeminfo.uefi = proc.returncode == 0
@@ -516,6 +516,9 @@ class VanillaDefaultDiskPartModal(Adw.Window):
         if self.is_active():
             current_partitions = self.__partitions.copy()
 
+            # GParted may have changed the LVM layout while we were unfocused
+            Diskutils.fetch_lvm_pvs(refresh=True)
+
             self.__partitions = []
             for disk in self.__disks:
                 disk.update_partitions()
@@ -14,11 +14,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
 import os
-import re
-import tempfile
+import uuid
+
+import orjson
 from datetime import datetime
 from typing import Any, Union
 
@@ -35,11 +35,24 @@ _REL_LINKS = ["usr", "etc", "usr/bin", "usr/lib",
 _REL_SYSTEM_LINKS = ["dev", "proc", "run", "srv", "sys", "media"]
 # fmt: on
 
+# Pre-joined commands for the root-adaptation shell step; the path lists are
+# module constants, so the strings only need to be built once
+_BASE_DIR_MKDIR_CMD = "mkdir -p " + " ".join(f"/mnt/a/{p}" for p in _BASE_DIRS)
+_REL_LINK_CMD = (
+    "ln -rs " + " ".join(f"/mnt/a/.system/{p}" for p in _REL_LINKS) + " /mnt/a/"
+)
+_REL_SYSTEM_RM_CMD = "rm -rf " + " ".join(
+    f"/mnt/a/.system/{p}" for p in _REL_SYSTEM_LINKS
+)
+_REL_SYSTEM_LINK_CMD = (
+    "ln -rs " + " ".join(f"/mnt/a/{p}" for p in _REL_SYSTEM_LINKS) + " /mnt/a/.system/"
+)
+
 _ROOT_GRUB_CFG = """insmod gzio
 insmod part_gpt
 insmod ext2
-linux   (lvm/vos--root-init)/vos-a/vmlinuz-%s root=%s quiet splash bgrt_disable $vt_handoff lsm=integrity
-initrd  (lvm/vos--root-init)/vos-a/initrd.img-%s
+linux   (lvm/vos--root-init)/vos-a/vmlinuz-{kernel_version} root={root} quiet splash bgrt_disable $vt_handoff lsm=integrity
+initrd  (lvm/vos--root-init)/vos-a/initrd.img-{kernel_version}
 """
 
 _BOOT_GRUB_CFG = """set default=0
@@ -134,11 +147,11 @@ menuentry "Previous State (B)" --class abroot-b {
 # END - AUTO GENERATED BY ABROOT
 """
 
-_ABIMAGE_FILE = """{
-    "digest":"%s",
-    "timestamp":"%s",
-    "image":"%s"
-}
+_ABIMAGE_FILE = """{{
+    "digest":"{digest}",
+    "timestamp":"{timestamp}",
+    "image":"{image}"
+}}
 """
 
 
@@ -146,65 +159,187 @@ AlbiusSetupStep = dict[str, Union[str, list[Any]]]
 AlbiusMountpoint = dict[str, str]
 AlbiusInstallation = dict[str, str | list[str]]
 AlbiusPostInstallStep = dict[str, Union[bool, str, list[Any]]]
+AlbiusRecipe = dict[str, Union[list[Any], AlbiusInstallation]]
+
+
+def _write_exec(payload: bytes) -> str:
+    """Write payload to a new executable file in /tmp and return its path.
+
+    Creating the file with mode 0o755 directly avoids the separate chmod
+    and the tempfile machinery of NamedTemporaryFile; O_EXCL makes sure a
+    pre-existing path (e.g. a symlink planted in /tmp) fails instead of
+    being followed.
+    """
+    path = f"/tmp/vi-{uuid.uuid4().hex}"
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_CLOEXEC, 0o755)
+    try:
+        os.write(fd, payload)
+    finally:
+        os.close(fd)
+    return path
+
+
+def _postinstall_step(
+    operation: str, params: list[Any], chroot: bool = False
+) -> AlbiusPostInstallStep:
+    return {
+        "chroot": chroot,
+        "operation": operation,
+        "params": params,
+    }
+
+
+# Post-install steps that are identical on every run are built once at import
+# time; they are only ever serialized, so sharing the same dict is safe.
+_HOSTNAME_STEP = _postinstall_step("hostname", ["vanilla"], chroot=True)
+
+_ADDUSER_STEP = _postinstall_step(
+    "adduser",
+    [
+        "vanilla",
+        "vanilla",
+        ["sudo", "lpadmin"],
+        "vanilla",
+        1200,
+    ],
+    chroot=True,
+)
+
+_AUTOLOGIN_STEP = _postinstall_step(
+    "shell",
+    [
+        "mkdir -p /etc/gdm3",
+        "echo '[daemon]\nAutomaticLogin=vanilla\nAutomaticLoginEnable=True' > /etc/gdm3/daemon.conf",
+        "mkdir -p /home/vanilla/.config/dconf",
+        "chmod 700 /home/vanilla/.config/dconf",
+    ],
+    chroot=True,
+)
+
+_FIRST_SETUP_SESSION_STEP = _postinstall_step(
+    "shell",
+    [
+        "mkdir -p /var/lib/AccountsService/users",
+        "echo '[User]\nSession=firstsetup' > /var/lib/AccountsService/users/vanilla",
+    ],
+    chroot=True,
+)
+
+
+_AUTOSTART_FIRST_SETUP_STEP = _postinstall_step(
+    "shell",
+    [
+        "mkdir -p /home/vanilla/.config/autostart",
+        "cp /usr/share/applications/org.vanillaos.FirstSetup.desktop /home/vanilla/.config/autostart",
+    ],
+    chroot=True,
+)
+
+_GRUB_MKCONFIG_STEP = _postinstall_step(
+    "grub-mkconfig", ["/boot/grub/grub.cfg"], chroot=True
+)
+
+_BOOT_GRUB_WRITE_STEP = _postinstall_step(
+    "shell",
+    [
+        "cat > /mnt/a/boot/grub/grub.cfg <<'VANILLA_EOF'\n"
+        + _BOOT_GRUB_CFG
+        + "VANILLA_EOF"
+    ],
+)
+
+_BOOT_UMOUNT_STEP = _postinstall_step(
+    "shell", ["umount -l /mnt/a/boot", "mkdir -p /mnt/a/boot/grub"]
+)
+
+_GRUB_MKCONFIG_LINK_STEP = _postinstall_step(
+    "shell",
+    ["ln -s /usr/libexec/grub-mkconfig /usr/sbin/grub-mkconfig"],
+    chroot=True,
+)
+
+_GRUB_MKCONFIG_UNLINK_STEP = _postinstall_step(
+    "shell", ["rm /usr/sbin/grub-mkconfig"], chroot=True
+)
+
+_INIT_LV_COPY_STEP = _postinstall_step(
+    "shell",
+    [
+        "mkdir /.system/boot/init",
+        "mount /dev/vos-root/init /.system/boot/init",
+        "mkdir /.system/boot/init/vos-a",
+        "mkdir /.system/boot/init/vos-b",
+        "mv /.system/boot/vmlinuz* /.system/boot/init/vos-a",
+    ],
+    chroot=True,
+)
+
+_ETC_OVERLAY_STEP = _postinstall_step(
+    "shell",
+    [
+        "mv /.system/home /var",
+        "mv /.system/opt /var",
+        "mv /.system/tmp /var",
+        "mkdir -p /var/lib/abroot/etc/vos-a /var/lib/abroot/etc/vos-b /var/lib/abroot/etc/vos-a-work /var/lib/abroot/etc/vos-b-work",
+        "mount -t overlay overlay -o lowerdir=/.system/etc,upperdir=/var/lib/abroot/etc/vos-a,workdir=/var/lib/abroot/etc/vos-a-work /etc",
+        "mv /var/storage /var/lib/abroot/",
+        "mount -o bind /var/home /home",
+        "mount -o bind /var/opt /opt",
+    ],
+    chroot=True,
+)
+
+_HOME_OWNERSHIP_STEP = _postinstall_step(
+    "shell",
+    ["chown -R vanilla:vanilla /home/vanilla"],
+    chroot=True,
+)
+
+_ABROOT_THIN_STEP = _postinstall_step(
+    "shell",
+    [
+        "mkdir -p /etc/abroot",
+        'echo "$(head -n-1 /usr/share/abroot/abroot.json),\n  \\"PartCryptVar\\": \\"/dev/mapper/vos--var-var\\",\n  \\"thinProvisioning\\": true,\n    \\"thinInitVolume\\": \\"vos-init\\"\n}" > /etc/abroot/abroot.json',
+        "cp /etc/abroot/abroot.json /usr/share/abroot/abroot.json",
+    ],
+    chroot=True,
+)
+
+
+def _timezone_steps(value: dict) -> list[AlbiusPostInstallStep]:
+    return [
+        _postinstall_step(
+            "timezone", [f"{value['region']}/{value['zone']}"], chroot=True
+        )
+    ]
 
 
-class AlbiusRecipe:
-    def __init__(self) -> None:
-        self.setup: list[AlbiusSetupStep] = []
-        self.mountpoints: list[AlbiusMountpoint] = []
-        self.installation: AlbiusInstallation = {}
-        self.postInstallation: list[AlbiusPostInstallStep] = []
-        self.latePostInstallation: list[AlbiusPostInstallStep] = []
-
-    def add_setup_step(self, disk: str, operation: str, params: list[Any]) -> None:
-        self.setup.append(
-            {
-                "disk": disk,
-                "operation": operation,
-                "params": params,
-            }
-        )
+def _language_steps(value: str) -> list[AlbiusPostInstallStep]:
+    return [_postinstall_step("locale", [value], chroot=True)]
 
-    def add_mountpoint(self, partition: str, target: str) -> None:
-        self.mountpoints.append(
-            {
-                "partition": partition,
-                "target": target,
-            }
-        )
 
-    def set_installation(self, method: str, source: str) -> None:
-        self.installation = {
-            "method": method,
-            "source": source,
-            "initramfsPre": ["lpkg --unlock"],
-            "initramfsPost": ["lpkg --lock"],
-        }
+def _keyboard_steps(value: list[dict]) -> list[AlbiusPostInstallStep]:
+    return [
+        _postinstall_step(
+            "keyboard",
+            [
+                i["layout"],
+                i["model"],
+                i["variant"],
+            ],
+            chroot=True,
+        )
+        for i in value
+    ]
 
-    def add_postinstall_step(
-        self, operation: str, params: list[Any], chroot: bool = False, late=False
-    ):
-        if not late:
-            self.postInstallation.append(
-                {
-                    "chroot": chroot,
-                    "operation": operation,
-                    "params": params,
-                }
-            )
-        else:
-            self.latePostInstallation.append(
-                {
-                    "chroot": chroot,
-                    "operation": operation,
-                    "params": params,
-                }
-            )
 
-    def merge_postinstall_steps(self):
-        for step in self.latePostInstallation:
-            self.postInstallation.append(step)
-        del self.latePostInstallation
+# Maps a key in `finals` to the post-install steps it contributes, so the
+# final loop does a single dict lookup instead of an if/elif chain per key.
+_FINAL_STEP_HANDLERS = {
+    "timezone": _timezone_steps,
+    "language": _language_steps,
+    "keyboard": _keyboard_steps,
+}
 
 
 class Processor:
@@ -215,84 +350,62 @@ class Processor:
         root_size: int,
         existing_pvs: list[str] | None,
         existing_vgs: list[str] | None,
+        is_uefi: bool,
         password: str | None = None,
     ):
-        setup_steps = []
-        mountpoints = []
         post_install_steps = []
 
-        # Before we do anything, we need to remove conflicting LVM objects
-        for vg in existing_vgs:
-            setup_steps.append([disk, "vgremove", [vg]])
-        for pv in existing_pvs:
-            setup_steps.append([disk, "pvremove", [pv]])
-
-        setup_steps.append([disk, "label", ["gpt"]])
-        # Boot
-        setup_steps.append([disk, "mkpart", ["vos-boot", "ext4", 1, 1025]])
-        setup_steps.append([disk, "mkpart", ["vos-efi", "fat32", 1025, 1537]])
-        setup_steps.append([disk, "setflag", ["2", "esp", True]])
-
-        # LVM PVs
-        setup_steps.append([disk, "mkpart", ["vos-root", "none", 1537, 23656]])
-        setup_steps.append([disk, "mkpart", ["vos-var", "none", 23656, -1]])
-        part_prefix = f"{disk}p" if re.match(r"[0-9]", disk[-1]) else f"{disk}"
-        setup_steps.append([disk, "pvcreate", [part_prefix + "3"]])
-        setup_steps.append([disk, "pvcreate", [part_prefix + "4"]])
-
-        # LVM VGs
-        setup_steps.append([disk, "vgcreate", ["vos-root", [part_prefix + "3"]]])
-        setup_steps.append([disk, "vgcreate", ["vos-var", [part_prefix + "4"]]])
-
-        # Init files LV
-        setup_steps.append([disk, "lvcreate", ["init", "vos-root", "linear", 512]])
-        setup_steps.append([disk, "lvm-format", ["vos-root/init", "ext4", "vos-init"]])
-
-        # LVM root thin pool
-        setup_steps.append([disk, "lvcreate", ["root", "vos-root", "linear", 19456]])
-        setup_steps.append(
-            [disk, "lvcreate", ["root-meta", "vos-root", "linear", 1024]]
-        )
-        setup_steps.append(
-            [
-                disk,
-                "make-thin-pool",
-                ["vos-root/root", "vos-root/root-meta"],
-            ]
-        )
-        setup_steps.append(
-            [disk, "lvcreate-thin", ["root-a", "vos-root", 19456, "root"]]
-        )
-        setup_steps.append(
-            [disk, "lvcreate-thin", ["root-b", "vos-root", 19456, "root"]]
-        )
-        setup_steps.append([disk, "lvm-format", ["vos-root/root-a", "btrfs", "vos-a"]])
-        setup_steps.append([disk, "lvm-format", ["vos-root/root-b", "btrfs", "vos-b"]])
+        part_prefix = f"{disk}p" if disk[-1].isdigit() else f"{disk}"
 
-        # LVM var
-        setup_steps.append([disk, "lvcreate", ["var", "vos-var", "linear", "100%FREE"]])
         lvm_var_args = ["vos-var/var", "btrfs", "vos-var"]
         if encrypt:
             assert password
             lvm_var_args.insert(2, password)
-        setup_steps.append(
-            [disk, "lvm-luks-format" if encrypt else "lvm-format", lvm_var_args]
-        )
-
-        # Mountpoints
-        if not re.match(r"[0-9]", disk[-1]):
-            part_prefix = f"{disk}"
-        else:
-            part_prefix = f"{disk}p"
-
-        mountpoints.append([part_prefix + "1", "/boot"])
 
-        if Systeminfo.is_uefi():
-            mountpoints.append([part_prefix + "2", "/boot/efi"])
+        # All setup steps share the same target disk, so describe them as
+        # (operation, params) pairs and materialize the steps in one pass.
+        setup_specs = [
+            # Before we do anything, we need to remove conflicting LVM objects
+            *[("vgremove", [vg]) for vg in existing_vgs],
+            *[("pvremove", [pv]) for pv in existing_pvs],
+            ("label", ["gpt"]),
+            # Boot
+            ("mkpart", ["vos-boot", "ext4", 1, 1025]),
+            ("mkpart", ["vos-efi", "fat32", 1025, 1537]),
+            ("setflag", ["2", "esp", True]),
+            # LVM PVs
+            ("mkpart", ["vos-root", "none", 1537, 23656]),
+            ("mkpart", ["vos-var", "none", 23656, -1]),
+            ("pvcreate", [part_prefix + "3"]),
+            ("pvcreate", [part_prefix + "4"]),
+            # LVM VGs
+            ("vgcreate", ["vos-root", [part_prefix + "3"]]),
+            ("vgcreate", ["vos-var", [part_prefix + "4"]]),
+            # Init files LV
+            ("lvcreate", ["init", "vos-root", "linear", 512]),
+            ("lvm-format", ["vos-root/init", "ext4", "vos-init"]),
+            # LVM root thin pool
+            ("lvcreate", ["root", "vos-root", "linear", 19456]),
+            ("lvcreate", ["root-meta", "vos-root", "linear", 1024]),
+            ("make-thin-pool", ["vos-root/root", "vos-root/root-meta"]),
+            ("lvcreate-thin", ["root-a", "vos-root", 19456, "root"]),
+            ("lvcreate-thin", ["root-b", "vos-root", 19456, "root"]),
+            ("lvm-format", ["vos-root/root-a", "btrfs", "vos-a"]),
+            ("lvm-format", ["vos-root/root-b", "btrfs", "vos-b"]),
+            # LVM var
+            ("lvcreate", ["var", "vos-var", "linear", "100%FREE"]),
+            ("lvm-luks-format" if encrypt else "lvm-format", lvm_var_args),
+        ]
+        setup_steps = [[disk, operation, params] for operation, params in setup_specs]
 
-        mountpoints.append(["/dev/vos-root/root-a", "/"])
-        mountpoints.append(["/dev/vos-root/root-b", "/"])
-        mountpoints.append(["/dev/vos-var/var", "/var"])
+        # Mountpoints
+        mountpoints = [
+            [part_prefix + "1", "/boot"],
+            *([[part_prefix + "2", "/boot/efi"]] if is_uefi else []),
+            ["/dev/vos-root/root-a", "/"],
+            ["/dev/vos-root/root-b", "/"],
+            ["/dev/vos-var/var", "/var"],
+        ]
 
         return setup_steps, mountpoints, post_install_steps, disk
 
@@ -415,98 +528,130 @@ class Processor:
         return setup_steps, mountpoints, post_install_steps, boot_disk
 
     @staticmethod
-    def __find_partitions(recipe: AlbiusRecipe) -> tuple[str, str, str, str, str]:
-        boot_partition = ""
-        efi_partition = ""
-        root_a_partition = ""
-        root_b_partition = ""
-        var_partition = ""
-
-        for mnt in recipe.mountpoints:
-            if mnt["target"] == "/boot":
-                boot_partition = mnt["partition"]
-            elif mnt["target"] == "/boot/efi":
-                efi_partition = mnt["partition"]
-            elif mnt["target"] == "/":
-                if not root_a_partition:
-                    root_a_partition = mnt["partition"]
-                else:
-                    root_b_partition = mnt["partition"]
-            elif mnt["target"] == "/var":
-                var_partition = mnt["partition"]
+    def __find_partitions(
+        mountpoints: list[AlbiusMountpoint],
+    ) -> tuple[str, str, str, str, str]:
+        target_to_field = {"/boot": "boot", "/boot/efi": "efi", "/var": "var"}
+        found = {"boot": "", "efi": "", "root_a": "", "root_b": "", "var": ""}
+
+        for mnt in mountpoints:
+            target = mnt["target"]
+            if target == "/":
+                # The first root mountpoint is root A, the second root B
+                found["root_b" if found["root_a"] else "root_a"] = mnt["partition"]
+            elif target in target_to_field:
+                found[target_to_field[target]] = mnt["partition"]
 
         return (
-            boot_partition,
-            efi_partition,
-            root_a_partition,
-            root_b_partition,
-            var_partition,
+            found["boot"],
+            found["efi"],
+            found["root_a"],
+            found["root_b"],
+            found["var"],
         )
 
     @staticmethod
     def gen_install_recipe(log_path, finals, sys_recipe):
         logger.info("processing the following final data: %s", finals)
 
-        recipe = AlbiusRecipe()
+        recipe: AlbiusRecipe = {
+            "setup": [],
+            "mountpoints": [],
+            "installation": {},
+            "postInstallation": [],
+        }
+        late_postinstall_steps: list[AlbiusPostInstallStep] = []
+
+        # Both values are stable for the lifetime of the call; probe them once
+        is_uefi = Systeminfo.is_uefi()
+        now_iso = datetime.now().astimezone().isoformat()
 
         images = sys_recipe.get("images")
         root_size = sys_recipe.get("default_root_size")
         oci_image = images["default"]
 
+        # Index the finals once: every step contributes a single key, so one
+        # pass replaces the separate scans for encryption, disk and image
+        index: dict[str, Any] = {}
+        for final in finals:
+            index.update(final)
+
         # Setup encryption if user selected it
         encrypt = False
         password = None
-        for final in finals:
-            if "encryption" in final.keys():
-                encrypt = final["encryption"]["use_encryption"]
-                password = final["encryption"]["encryption_key"] if encrypt else None
+        encryption = index.get("encryption")
+        if encryption is not None:
+            encrypt = encryption["use_encryption"]
+            password = encryption["encryption_key"] if encrypt else None
 
         boot_disk = None
 
         # Setup disks and mountpoints
-        for final in finals:
-            if "disk" in final.keys():
-                if "auto" in final["disk"].keys():
-                    part_info = Processor.__gen_auto_partition_steps(
-                        final["disk"]["auto"]["disk"],
-                        encrypt,
-                        root_size,
-                        final["disk"]["auto"]["pvs_to_remove"],
-                        final["disk"]["auto"]["vgs_to_remove"],
-                        password,
-                    )
-                else:
-                    part_info = Processor.__gen_manual_partition_steps(
-                        final["disk"], encrypt, password
-                    )
-
-                setup_steps, mountpoints, post_install_steps, boot_disk = part_info
-                for step in setup_steps:
-                    recipe.add_setup_step(*step)
-                for mount in mountpoints:
-                    recipe.add_mountpoint(*mount)
-                for step in post_install_steps:
-                    recipe.add_postinstall_step(*step)
-            elif "custom_image" in final.keys():
-                oci_image = final["custom_image"]
-            elif "nvidia" in final.keys():
-                if final["nvidia"]["use-proprietary"]:
-                    oci_image = images["nvidia"]
-            elif "vm" in final.keys():
-                if final["vm"]["use-vm-tools"]:
-                    oci_image = images["vm"]
+        disk_final = index.get("disk")
+        if disk_final is not None:
+            if "auto" in disk_final:
+                part_info = Processor.__gen_auto_partition_steps(
+                    disk_final["auto"]["disk"],
+                    encrypt,
+                    root_size,
+                    disk_final["auto"]["pvs_to_remove"],
+                    disk_final["auto"]["vgs_to_remove"],
+                    is_uefi,
+                    password,
+                )
+            else:
+                part_info = Processor.__gen_manual_partition_steps(
+                    disk_final, encrypt, password
+                )
+
+            setup_steps, mountpoints, post_install_steps, boot_disk = part_info
+            for step_disk, operation, params in setup_steps:
+                recipe["setup"].append(
+                    {
+                        "disk": step_disk,
+                        "operation": operation,
+                        "params": params,
+                    }
+                )
+            for partition, target in mountpoints:
+                recipe["mountpoints"].append(
+                    {
+                        "partition": partition,
+                        "target": target,
+                    }
+                )
+            for step in post_install_steps:
+                recipe["postInstallation"].append(_postinstall_step(*step))
+
+        # Pick the OCI image; a custom image wins over the nvidia/vm variants,
+        # matching the order the steps appear in the tour
+        if index.get("nvidia", {}).get("use-proprietary"):
+            oci_image = images["nvidia"]
+        if index.get("vm", {}).get("use-vm-tools"):
+            oci_image = images["vm"]
+        if "custom_image" in index:
+            oci_image = index["custom_image"]
 
         # Installation
-        recipe.set_installation("oci", oci_image)
+        recipe["installation"] = {
+            "method": "oci",
+            "source": oci_image,
+            "initramfsPre": ["lpkg --unlock"],
+            "initramfsPost": ["lpkg --lock"],
+        }
 
         # Post-installation
+        # NOTE: Albius runs these steps strictly in list order and the steps
+        # carry no dependency metadata; every append below implicitly depends
+        # on its predecessors (mounts, GRUB files, the /etc overlay), so the
+        # textual order in this function is the dependency order.
         (
             boot_part,
             efi_part,
             root_a_part,
             root_b_part,
             var_part,
-        ) = Processor.__find_partitions(recipe)
+        ) = Processor.__find_partitions(recipe["mountpoints"])
 
         if "VANILLA_SKIP_POSTINSTALL" not in os.environ:
             # Adapt root A filesystem structure
@@ -514,265 +659,167 @@ class Processor:
                 var_label = f"/dev/mapper/luks-$(lsblk -d -y -n -o UUID {var_part})"
             else:
                 var_label = var_part
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    "umount /mnt/a/var",
-                    "mkdir /mnt/a/tmp-boot",
-                    "cp -r /mnt/a/boot /mnt/a/tmp-boot",
-                    f"umount -l {boot_part}",
-                    "mkdir -p /mnt/a/.system",
-                    "mv /mnt/a/* /mnt/a/.system/",
-                    "mv /mnt/a/.system/tmp-boot/boot/* /mnt/a/.system/boot",
-                    "rm -rf /mnt/a/.system/tmp-boot",
-                    *[f"mkdir -p /mnt/a/{path}" for path in _BASE_DIRS],
-                    *[f"ln -rs /mnt/a/.system/{path} /mnt/a/" for path in _REL_LINKS],
-                    *[f"rm -rf /mnt/a/.system/{path}" for path in _REL_SYSTEM_LINKS],
-                    *[
-                        f"ln -rs /mnt/a/{path} /mnt/a/.system/"
-                        for path in _REL_SYSTEM_LINKS
+            # One shell invocation for the whole block: mkdir/ln/rm take all
+            # their targets in a single command each, and the commands run as
+            # one `set -e` script instead of one process per command
+            recipe["postInstallation"].append(
+                _postinstall_step(
+                    "shell",
+                    [
+                        "\n".join(
+                            [
+                                "set -e",
+                                "umount /mnt/a/var",
+                                "mkdir /mnt/a/tmp-boot",
+                                "cp -r /mnt/a/boot /mnt/a/tmp-boot",
+                                f"umount -l {boot_part}",
+                                "mkdir -p /mnt/a/.system",
+                                "mv /mnt/a/* /mnt/a/.system/",
+                                "mv /mnt/a/.system/tmp-boot/boot/* /mnt/a/.system/boot",
+                                "rm -rf /mnt/a/.system/tmp-boot",
+                                _BASE_DIR_MKDIR_CMD,
+                                _REL_LINK_CMD,
+                                _REL_SYSTEM_RM_CMD,
+                                _REL_SYSTEM_LINK_CMD,
+                                f"mount {var_label} /mnt/a/var",
+                                f"mount {boot_part} /mnt/a/boot{f' && mount {efi_part} /mnt/a/boot/efi' if efi_part else ''}",
+                            ]
+                        )
                     ],
-                    f"mount {var_label} /mnt/a/var",
-                    f"mount {boot_part} /mnt/a/boot{f' && mount {efi_part} /mnt/a/boot/efi' if efi_part else ''}",
-                ],
+                )
             )
 
             # Create default user
             # This needs to be done after mounting `/etc` overlay, so set it as
             # late post-install
-            recipe.add_postinstall_step(
-                "adduser",
-                [
-                    "vanilla",
-                    "vanilla",
-                    ["sudo", "lpadmin"],
-                    "vanilla",
-                    1200,
-                ],
-                chroot=True,
-                late=True,
-            )
+            late_postinstall_steps.append(_ADDUSER_STEP)
 
             # Set vanilla user to autologin
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    "mkdir -p /etc/gdm3",
-                    "echo '[daemon]\nAutomaticLogin=vanilla\nAutomaticLoginEnable=True' > /etc/gdm3/daemon.conf",
-                    "mkdir -p /home/vanilla/.config/dconf",
-                    "chmod 700 /home/vanilla/.config/dconf",
-                ],
-                chroot=True,
-            )
+            recipe["postInstallation"].append(_AUTOLOGIN_STEP)
 
             # Make sure the vanilla user uses the first-setup session
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    "mkdir -p /var/lib/AccountsService/users",
-                    "echo '[User]\nSession=firstsetup' > /var/lib/AccountsService/users/vanilla",
-                ],
-                chroot=True,
-            )
+            recipe["postInstallation"].append(_FIRST_SETUP_SESSION_STEP)
 
             # Add autostart script to vanilla-first-setup
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    "mkdir -p /home/vanilla/.config/autostart",
-                    "cp /usr/share/applications/org.vanillaos.FirstSetup.desktop /home/vanilla/.config/autostart",
-                ],
-                chroot=True,
-                late=True,
-            )
+            late_postinstall_steps.append(_AUTOSTART_FIRST_SETUP_STEP)
 
             # TODO: Install grub-pc if target is BIOS
             # Run `grub-install` with the boot partition as target
-            grub_type = "efi" if Systeminfo.is_uefi() else "bios"
-            recipe.add_postinstall_step(
-                "grub-install", ["/mnt/a/boot", boot_disk, grub_type, efi_part]
+            grub_type = "efi" if is_uefi else "bios"
+            recipe["postInstallation"].append(
+                _postinstall_step(
+                    "grub-install", ["/mnt/a/boot", boot_disk, grub_type, efi_part]
+                )
             )
-            recipe.add_postinstall_step(
-                "grub-install", ["/boot", boot_disk, grub_type, efi_part], chroot=True
+            recipe["postInstallation"].append(
+                _postinstall_step(
+                    "grub-install",
+                    ["/boot", boot_disk, grub_type, efi_part],
+                    chroot=True,
+                )
             )
 
             # Run `grub-mkconfig` to generate files for the boot partition
-            recipe.add_postinstall_step(
-                "grub-mkconfig", ["/boot/grub/grub.cfg"], chroot=True
-            )
+            recipe["postInstallation"].append(_GRUB_MKCONFIG_STEP)
 
             # Replace main GRUB entry in the boot partition
-            with open("/tmp/boot-grub.cfg", "w") as file:
-                file.write(_BOOT_GRUB_CFG)
-            recipe.add_postinstall_step(
-                "shell", ["cp /tmp/boot-grub.cfg /mnt/a/boot/grub/grub.cfg"]
-            )
+            recipe["postInstallation"].append(_BOOT_GRUB_WRITE_STEP)
 
             # Unmount boot partition so we can modify the root GRUB config
-            recipe.add_postinstall_step(
-                "shell", ["umount -l /mnt/a/boot", "mkdir -p /mnt/a/boot/grub"]
-            )
+            recipe["postInstallation"].append(_BOOT_UMOUNT_STEP)
 
             # Since /usr/sbin/grub-mkconfig deletes itself after the first invocation
             # we need to use the alternative path
-            recipe.add_postinstall_step(
-                "shell", ["ln -s /usr/libexec/grub-mkconfig /usr/sbin/grub-mkconfig"], chroot=True
-            )
+            recipe["postInstallation"].append(_GRUB_MKCONFIG_LINK_STEP)
 
             # Run `grub-mkconfig` inside the root partition
-            recipe.add_postinstall_step(
-                "grub-mkconfig", ["/boot/grub/grub.cfg"], chroot=True
-            )
+            recipe["postInstallation"].append(_GRUB_MKCONFIG_STEP)
 
             # Delete link again so that users don't break their system with it
-            recipe.add_postinstall_step(
-                "shell", ["rm /usr/sbin/grub-mkconfig"], chroot=True
-            )
+            recipe["postInstallation"].append(_GRUB_MKCONFIG_UNLINK_STEP)
 
             # Copy init files to init LV
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    "mkdir /.system/boot/init",
-                    "mount /dev/vos-root/init /.system/boot/init",
-                    "mkdir /.system/boot/init/vos-a",
-                    "mkdir /.system/boot/init/vos-b",
-                    "mv /.system/boot/vmlinuz* /.system/boot/init/vos-a",
-                ],
-                chroot=True,
-            )
+            recipe["postInstallation"].append(_INIT_LV_COPY_STEP)
 
             # Add `/boot/grub/abroot.cfg` to the root partition
-            with open("/tmp/abroot.cfg", "w") as file:
-                root_entry = _ROOT_GRUB_CFG % (
-                    "$KERNEL_VERSION",
-                    "UUID=$ROOTA_UUID",
-                    "$KERNEL_VERSION",
+            root_entry = _ROOT_GRUB_CFG.format(
+                kernel_version="$KERNEL_VERSION",
+                root="UUID=$ROOTA_UUID",
+            )
+            recipe["postInstallation"].append(
+                _postinstall_step(
+                    "shell",
+                    [
+                        f"BOOT_UUID=$(lsblk -d -n -o UUID {boot_part}) "
+                        f"ROOTA_UUID=$(lsblk -d -n -o UUID {root_a_part}) "
+                        "KERNEL_VERSION=$(ls -1 /mnt/a/usr/lib/modules | sed '1p;d') "
+                        "envsubst '$BOOT_UUID $ROOTA_UUID $KERNEL_VERSION' "
+                        "> /mnt/a/.system/boot/init/vos-a/abroot.cfg <<'VANILLA_EOF'\n"
+                        + root_entry
+                        + "VANILLA_EOF"
+                    ],
                 )
-                file.write(root_entry)
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    " ".join(
-                        f"BOOT_UUID=$(lsblk -d -n -o UUID {boot_part}) \
-                        ROOTA_UUID=$(lsblk -d -n -o UUID {root_a_part}) \
-                        KERNEL_VERSION=$(ls -1 /mnt/a/usr/lib/modules | sed '1p;d') \
-                        envsubst < /tmp/abroot.cfg > /mnt/a/.system/boot/init/vos-a/abroot.cfg \
-                        '$BOOT_UUID $ROOTA_UUID $KERNEL_VERSION'".split()
-                    )
-                ],
             )
 
             # Mount `/etc` as overlay; `/home`, `/opt` and `/usr` as bind
-            recipe.add_postinstall_step(
-                "shell",
-                [
-                    "mv /.system/home /var",
-                    "mv /.system/opt /var",
-                    "mv /.system/tmp /var",
-                    "mkdir -p /var/lib/abroot/etc/vos-a /var/lib/abroot/etc/vos-b /var/lib/abroot/etc/vos-a-work /var/lib/abroot/etc/vos-b-work",
-                    "mount -t overlay overlay -o lowerdir=/.system/etc,upperdir=/var/lib/abroot/etc/vos-a,workdir=/var/lib/abroot/etc/vos-a-work /etc",
-                    "mv /var/storage /var/lib/abroot/",
-                    "mount -o bind /var/home /home",
-                    "mount -o bind /var/opt /opt",
-                ],
-                chroot=True,
-            )
+            recipe["postInstallation"].append(_ETC_OVERLAY_STEP)
 
         # Set hostname
-        recipe.add_postinstall_step("hostname", ["vanilla"], chroot=True)
-        for final in finals:
-            for key, value in final.items():
-                # Set timezone
-                if key == "timezone":
-                    recipe.add_postinstall_step(
-                        "timezone", [f"{value['region']}/{value['zone']}"], chroot=True
-                    )
-                # Set locale
-                if key == "language":
-                    recipe.add_postinstall_step("locale", [value], chroot=True)
-                # Set keyboard
-                if key == "keyboard":
-                    for i in value:
-                        recipe.add_postinstall_step(
-                            "keyboard",
-                            [
-                                i["layout"],
-                                i["model"],
-                                i["variant"],
-                            ],
-                            chroot=True,
-                        )
+        recipe["postInstallation"].append(_HOSTNAME_STEP)
+        # Set timezone, locale and keyboard
+        for key, handler in _FINAL_STEP_HANDLERS.items():
+            if key in index:
+                recipe["postInstallation"].extend(handler(index[key]))
 
         # Create /abimage.abr
-        with open("/tmp/abimage.abr", "w") as file:
-            abimage = _ABIMAGE_FILE % (
-                "$IMAGE_DIGEST",
-                datetime.now().astimezone().isoformat(),
-                oci_image,
+        abimage = _ABIMAGE_FILE.format(
+            digest="$IMAGE_DIGEST",
+            timestamp=now_iso,
+            image=oci_image,
+        )
+        recipe["postInstallation"].append(
+            _postinstall_step(
+                "shell",
+                [
+                    "IMAGE_DIGEST=$(cat /mnt/a/.oci_digest) "
+                    "envsubst '$IMAGE_DIGEST' > /mnt/a/abimage.abr <<'VANILLA_EOF'\n"
+                    + abimage
+                    + "VANILLA_EOF"
+                ],
             )
-            file.write(abimage)
-
-        recipe.add_postinstall_step(
-            "shell",
-            [
-                " ".join(
-                    "IMAGE_DIGEST=$(cat /mnt/a/.oci_digest) \
-                    envsubst < /tmp/abimage.abr > /mnt/a/abimage.abr \
-                    '$IMAGE_DIGEST'".split()
-                )
-            ],
         )
 
         # Set the default user as the owner of it's home directory
-        recipe.add_postinstall_step(
-            "shell",
-            ["chown -R vanilla:vanilla /home/vanilla"],
-            chroot=True,
-            late=True,
-        )
+        late_postinstall_steps.append(_HOME_OWNERSHIP_STEP)
 
         # Set ABRoot Thin-Provisioning option
-        recipe.add_postinstall_step(
-            "shell",
-            [
-                "mkdir -p /etc/abroot",
-                'echo "$(head -n-1 /usr/share/abroot/abroot.json),\n  \\"PartCryptVar\\": \\"/dev/mapper/vos--var-var\\",\n  \\"thinProvisioning\\": true,\n    \\"thinInitVolume\\": \\"vos-init\\"\n}" > /etc/abroot/abroot.json',
-                "cp /etc/abroot/abroot.json /usr/share/abroot/abroot.json",
-            ],
-            chroot=True,
-        )
+        recipe["postInstallation"].append(_ABROOT_THIN_STEP)
 
         # Set up initramfs after all configuration is done
         # Need to mount boot for initramfs generated
         # Need to unmount afterwards to access init partition
-        recipe.add_postinstall_step(
-            "shell",
-            [
-                f"mount {boot_part} /boot",
-                f"mount {efi_part} /boot/efi",
-                "update-initramfs -c -k all",
-                "mkdir /var/tmp/vanilla-generated-initrd",
-                "cp -a /boot/initrd* /var/tmp/vanilla-generated-initrd/",
-                "umount -l /boot/efi",
-                "umount -l /boot",
-                "mv /var/tmp/vanilla-generated-initrd/initrd* /.system/boot/init/vos-a",
-            ],
-            chroot=True,
+        recipe["postInstallation"].append(
+            _postinstall_step(
+                "shell",
+                [
+                    f"mount {boot_part} /boot",
+                    f"mount {efi_part} /boot/efi",
+                    "update-initramfs -c -k all",
+                    "mkdir /var/tmp/vanilla-generated-initrd",
+                    "cp -a /boot/initrd* /var/tmp/vanilla-generated-initrd/",
+                    "umount -l /boot/efi",
+                    "umount -l /boot",
+                    "mv /var/tmp/vanilla-generated-initrd/initrd* /.system/boot/init/vos-a",
+                ],
+                chroot=True,
+            )
         )
 
-        recipe.merge_postinstall_steps()
+        # Late steps run after the `/etc` overlay is mounted, so they go last
+        recipe["postInstallation"].extend(late_postinstall_steps)
 
         if "VANILLA_FAKE" in os.environ:
-            logger.info(json.dumps(recipe, default=vars))
+            logger.info(orjson.dumps(recipe, option=orjson.OPT_INDENT_2).decode())
             return None
 
-        with tempfile.NamedTemporaryFile(mode="w", delete=False) as f:
-            f.write(json.dumps(recipe, default=vars))
-            f.flush()
-            f.close()
-
-            # setting the file executable
-            os.chmod(f.name, 0o755)
-
-            return f.name
+        return _write_exec(orjson.dumps(recipe))